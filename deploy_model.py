@@ -6,22 +6,163 @@ Usage: python deploy_model.py <model_path> <port>
 """
 import sys
 import os
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import copy
+import json
+import asyncio
+import threading
+import importlib.util
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, AutoConfig, BitsAndBytesConfig, DynamicCache, StaticCache
+)
 import torch
 
-app = Flask(__name__)
+# orjson is optional; the stdlib encoder is used when it isn't installed
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as ResponseClass
+except ImportError:
+    orjson = None
+    ResponseClass = JSONResponse
+
+# Requests arriving within BATCH_TIMEOUT of each other share one generate() call
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '8'))
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT_MS', '20')) / 1000
+request_queue = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global request_queue
+    request_queue = asyncio.Queue()
+    batcher = asyncio.create_task(batch_worker())
+    yield
+    batcher.cancel()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ResponseClass)
 
 # Global model variables
 model = None
 tokenizer = None
 model_name = "Unknown"
 
+# Prompt KV caches keyed by prompt token ids, least recently used first
+prefix_cache = OrderedDict()
+prefix_cache_bytes = 0
+prefix_cache_lock = threading.Lock()
+PREFIX_CACHE_LIMIT = int(os.environ.get('PREFIX_CACHE_MB', '512')) * 1024 * 1024
+
+# Request limits, checked before any tokenizer or model work
+MAX_PROMPT_CHARS = int(os.environ.get('MAX_PROMPT_CHARS', '8000'))
+MAX_GEN_LEN = int(os.environ.get('MAX_GEN_LEN', '512'))
+# ASCII-escaped JSON (json.dumps' default) spends up to 12 bytes on one character:
+# a surrogate pair of \uXXXX escapes for anything outside the BMP
+MAX_BODY_BYTES = MAX_PROMPT_CHARS * 12 + 1024
+
+# On CUDA the decode step runs from one captured graph, which needs fixed KV
+# shapes: requests up to STATIC_CACHE_LEN tokens share a preallocated static
+# cache per batch size instead of growing a dynamic one
+STATIC_CACHE_LEN = int(os.environ.get('STATIC_CACHE_LEN', '1024'))
+use_cuda_graphs = False
+static_caches = {}
+
+# Weight-only INT8 regresses latency on small models, so only quantize above this size
+INT8_MIN_PARAMS = 1_000_000_000
+
+def estimate_parameters(config):
+    """Rough decoder parameter count: 12 * n_layers * d_model^2 plus token embeddings"""
+    return 12 * config.num_hidden_layers * config.hidden_size ** 2 + config.vocab_size * config.hidden_size
+
+def get_static_cache(batch_size, total_len):
+    """Return the pinned static KV cache for batch_size, or None when CUDA graphs don't apply"""
+    if (not use_cuda_graphs or total_len > STATIC_CACHE_LEN
+            or not getattr(model, '_supports_static_cache', False)):
+        return None
+    cache = static_caches.get(batch_size)
+    if cache is None:
+        cache = StaticCache(
+            config=model.config,
+            max_batch_size=batch_size,
+            max_cache_len=STATIC_CACHE_LEN,
+            device=model.device,
+            dtype=model.dtype
+        )
+        static_caches[batch_size] = cache
+    else:
+        cache.reset()
+    return cache
+
+def compile_model():
+    """Compile the forward pass and warm it up so the first request doesn't stall on it"""
+    global use_cuda_graphs
+    if getattr(model, 'is_loaded_in_8bit', False):
+        return
+
+    # Compile forward rather than the module: wrapping a compiled module in
+    # pipeline(...) silently drops back to eager
+    eager_forward = model.forward
+    mode = "reduce-overhead"
+    try:
+        if model.device.type == 'cuda':
+            if getattr(model, '_supports_static_cache', False):
+                torch._inductor.config.triton.cudagraphs = True
+                use_cuda_graphs = True
+            else:
+                # A captured graph needs the fixed-shape static cache, which GPT-2 and
+                # other legacy-cache models refuse
+                mode = "default"
+                print("Model has no static KV cache support, skipping CUDA graphs")
+        model.forward = torch.compile(eager_forward, mode=mode, fullgraph=False)
+        dummy = torch.full((1, 16), tokenizer.eos_token_id, device=model.device)
+        with torch.no_grad():
+            # The first call compiles, the second captures the CUDA graph
+            for _ in range(2):
+                model.generate(
+                    dummy,
+                    attention_mask=torch.ones_like(dummy),
+                    past_key_values=get_static_cache(1, dummy.shape[1] + 4),
+                    max_new_tokens=4,
+                    do_sample=False,
+                    pad_token_id=tokenizer.eos_token_id
+                )
+        print("Model forward compiled")
+    except Exception as e:
+        model.forward = eager_forward
+        use_cuda_graphs = False
+        static_caches.clear()
+        print(f"torch.compile unavailable, running eager: {e}")
+
 def load_model(model_path):
     global model, tokenizer, model_name
     try:
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModelForCausalLM.from_pretrained(model_path)
+        tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side='left')
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        config = AutoConfig.from_pretrained(model_path)
+        use_cuda = torch.cuda.is_available()
+
+        if (use_cuda and importlib.util.find_spec('bitsandbytes')
+                and estimate_parameters(config) > INT8_MIN_PARAMS):
+            model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                device_map="auto"
+            )
+            print("Loaded INT8 weights via bitsandbytes")
+        else:
+            dtype = torch.float16 if use_cuda and not torch.cuda.is_bf16_supported() else torch.bfloat16
+            # Load weights directly onto the target device rather than staging them on the CPU
+            model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=dtype,
+                low_cpu_mem_usage=True,
+                device_map={'': 'cuda' if use_cuda else 'cpu'}
+            )
+        model.eval()
+        compile_model()
         model_name = os.path.basename(model_path)
         print(f"Model {model_name} loaded successfully")
         return True
@@ -29,50 +170,216 @@ def load_model(model_path):
         print(f"Failed to load model: {e}")
         return False
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
+def kv_cache_size(seq_len):
+    """Bytes held by the KV cache of one sequence: 2 * dtype_bytes * n_layers * d_model * seq_len"""
+    dtype_bytes = torch.empty((), dtype=model.dtype).element_size()
+    return 2 * dtype_bytes * model.config.num_hidden_layers * model.config.hidden_size * seq_len
+
+def crop_legacy_cache(past_key_values, length):
+    """Trim a legacy tuple-of-(key, value) cache to its first length positions"""
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past_key_values)
+
+def lookup_prefix(token_ids):
+    """Return a private copy of the cached KV for the longest shared prompt prefix"""
+    best_key, best_len = None, 0
+    # Leave at least one prompt token uncached so generate has something to prefill
+    max_len = len(token_ids) - 1
+    with prefix_cache_lock:
+        for key in prefix_cache:
+            limit = min(len(key), max_len)
+            n = 0
+            while n < limit and key[n] == token_ids[n]:
+                n += 1
+            if n > best_len:
+                best_key, best_len = key, n
+        if best_key is None:
+            return None
+        prefix_cache.move_to_end(best_key)
+        cached = prefix_cache[best_key]
+
+    # Legacy tuples are never written to in place, so slices of them are safe to share
+    if isinstance(cached, tuple):
+        return crop_legacy_cache(cached, best_len)
+
+    # Stored caches are never mutated, so copying outside the lock is safe
+    past_key_values = copy.deepcopy(cached)
+    past_key_values.crop(best_len)
+    return past_key_values
+
+def store_prefix(token_ids, past_key_values):
+    """Keep the prompt portion of a finished request's KV cache for reuse"""
+    global prefix_cache_bytes
+    key = tuple(token_ids)
+    size = kv_cache_size(len(key))
+    if size > PREFIX_CACHE_LIMIT:
+        return
+
+    # Models without Cache support (GPT-2 among them) only accept legacy tuples back
+    if not getattr(model, '_supports_cache_class', False):
+        if not isinstance(past_key_values, tuple):
+            past_key_values = past_key_values.to_legacy_cache()
+        past_key_values = crop_legacy_cache(past_key_values, len(key))
+    else:
+        if isinstance(past_key_values, tuple):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        past_key_values.crop(len(key))
+
+    with prefix_cache_lock:
+        if key in prefix_cache:
+            prefix_cache.move_to_end(key)
+            return
+        prefix_cache[key] = past_key_values
+        prefix_cache_bytes += size
+        while prefix_cache_bytes > PREFIX_CACHE_LIMIT:
+            evicted_key, _ = prefix_cache.popitem(last=False)
+            prefix_cache_bytes -= kv_cache_size(len(evicted_key))
+
+def generate_single(prompt, max_length, temperature):
+    """Generate for one prompt, reusing any cached KV for its prefix"""
+    inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
+    prompt_ids = inputs['input_ids'][0].tolist()
+    static_cache = get_static_cache(1, len(prompt_ids) + max_length)
+
+    # Weights are already BF16/FP16 from load_model; autocast keeps activations there too
+    with torch.inference_mode(), torch.autocast(device_type=model.device.type, dtype=model.dtype):
+        # generate() only prefills the tokens not covered by the cached prefix
+        outputs = model.generate(
+            **inputs,
+            past_key_values=static_cache if static_cache is not None else lookup_prefix(prompt_ids),
+            use_cache=True,
+            return_dict_in_generate=True,
+            max_length=len(prompt_ids) + max_length,
+            temperature=temperature,
+            do_sample=True,
+            pad_token_id=tokenizer.eos_token_id
+        )
+        if static_cache is None:
+            store_prefix(prompt_ids, outputs.past_key_values)
+
+    # Decode only the continuation; the prompt tokens never need detokenizing
+    new_tokens = outputs.sequences[0, len(prompt_ids):]
+    return [tokenizer.decode(new_tokens, skip_special_tokens=True).strip()]
+
+def generate_batch(prompts, max_length, temperature):
+    """Generate for several prompts sharing sampling settings in one padded batch"""
+    if len(prompts) == 1:
+        return generate_single(prompts[0], max_length, temperature)
+
+    # Left padding keeps every prompt's last token adjacent to its continuation
+    inputs = tokenizer(prompts, return_tensors='pt', padding=True).to(model.device)
+
+    with torch.inference_mode(), torch.autocast(device_type=model.device.type, dtype=model.dtype):
+        outputs = model.generate(
+            **inputs,
+            past_key_values=get_static_cache(len(prompts), inputs['input_ids'].shape[1] + max_length),
+            use_cache=True,
+            max_length=inputs['input_ids'].shape[1] + max_length,
+            temperature=temperature,
+            do_sample=True,
+            pad_token_id=tokenizer.pad_token_id
+        )
+
+    # Left padding puts every continuation at the same offset
+    new_tokens = outputs[:, inputs['input_ids'].shape[1]:]
+    return [response.strip() for response in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+async def batch_worker():
+    """Drain the request queue in micro-batches and resolve each request's future"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await request_queue.get()]
+        deadline = loop.time() + BATCH_TIMEOUT
+        while len(batch) < MAX_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(request_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # generate() takes one length and temperature, so split by sampling settings
+        groups = defaultdict(list)
+        for item in batch:
+            groups[item[1:3]].append(item)
+
+        for (max_length, temperature), items in groups.items():
+            prompts = [item[0] for item in items]
+            try:
+                responses = await loop.run_in_executor(
+                    None, generate_batch, prompts, max_length, temperature
+                )
+                for item, response in zip(items, responses):
+                    if not item[3].done():
+                        item[3].set_result(response)
+            except Exception as e:
+                for item in items:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+
+@app.get('/health')
+async def health():
+    return {
         'status': 'healthy',
         'model': model_name,
         'loaded': model is not None
-    })
+    }
 
-@app.route('/generate', methods=['POST'])
-def generate():
+@app.post('/generate')
+async def generate(request: Request):
     if not model or not tokenizer:
-        return jsonify({'error': 'Model not loaded'}), 500
+        return ResponseClass({'error': 'Model not loaded'}, status_code=500)
     
-    data = request.json
+    # Refuse oversized bodies from the declared length, then cap what is actually read,
+    # so a large upload is never buffered in full
+    declared = request.headers.get('content-length')
+    if declared is not None and (not declared.isdigit() or int(declared) > MAX_BODY_BYTES):
+        return ResponseClass({'error': 'Request too large'}, status_code=413)
+    chunks, received = [], 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_BODY_BYTES:
+            return ResponseClass({'error': 'Request too large'}, status_code=413)
+        chunks.append(chunk)
+    body = b''.join(chunks)
+    try:
+        data = orjson.loads(body) if orjson else json.loads(body)
+    except ValueError:
+        return ResponseClass({'error': 'Invalid JSON'}, status_code=400)
+    if not isinstance(data, dict):
+        return ResponseClass({'error': 'Expected a JSON object'}, status_code=400)
     prompt = data.get('prompt', '')
     max_length = data.get('max_length', 100)
     temperature = data.get('temperature', 0.7)
     
     if not prompt:
-        return jsonify({'error': 'Prompt required'}), 400
+        return ResponseClass({'error': 'Prompt required'}, status_code=400)
+    if not isinstance(prompt, str) or len(prompt) > MAX_PROMPT_CHARS:
+        return ResponseClass(
+            {'error': f'Prompt must be a string of at most {MAX_PROMPT_CHARS} characters'},
+            status_code=400
+        )
+    if isinstance(max_length, bool) or not isinstance(max_length, int) or not 0 < max_length <= MAX_GEN_LEN:
+        return ResponseClass(
+            {'error': f'max_length must be an integer between 1 and {MAX_GEN_LEN}'},
+            status_code=400
+        )
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or temperature <= 0:
+        return ResponseClass({'error': 'temperature must be a positive number'}, status_code=400)
     
     try:
-        inputs = tokenizer(prompt, return_tensors='pt')
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_length=len(inputs['input_ids'][0]) + max_length,
-                temperature=temperature,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
-            )
-        
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        response = response[len(prompt):].strip()
+        future = asyncio.get_running_loop().create_future()
+        await request_queue.put((prompt, max_length, temperature, future))
+        response = await future
         
-        return jsonify({
+        return {
             'generated_text': response,
             'prompt': prompt,
             'model': model_name
-        })
+        }
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ResponseClass({'error': str(e)}, status_code=500)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -88,7 +395,7 @@ if __name__ == '__main__':
     
     if load_model(model_path):
         print(f"Starting model server on port {port}")
-        app.run(host='0.0.0.0', port=port, debug=False)
+        uvicorn.run(app, host='0.0.0.0', port=port)
     else:
         print("Failed to start model server")
         sys.exit(1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Shared ML service operations
+JSON I/O, dataset line counting and the stdin request loop used by the ML services
+"""
+
+import sys
+import json
+import os
+import codecs
+from functools import lru_cache, wraps
+
+# orjson is optional; fall back to the stdlib encoder when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Messages are newline-delimited JSON by default. ML_SERVICE_FRAMING=length switches
+# both directions to a 4-byte big-endian length prefix per message, so readers
+# need no line scanning and payloads may contain raw newlines
+LENGTH_FRAMED = os.environ.get('ML_SERVICE_FRAMING') == 'length'
+
+def loads(raw):
+    """Parse a JSON document, via orjson when available"""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def dumps(obj):
+    """Encode a JSON document to bytes, via orjson when available"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj).encode()
+
+def write_message(payload):
+    """Queue one encoded message on stdout in the active framing, without flushing"""
+    if LENGTH_FRAMED:
+        sys.stdout.buffer.write(len(payload).to_bytes(4, 'big') + payload)
+    else:
+        sys.stdout.buffer.write(payload + b'\n')
+
+def print_json(obj):
+    """Write one JSON document to stdout and flush"""
+    # Anything printed through the text layer goes out first
+    sys.stdout.flush()
+    write_message(dumps(obj))
+    sys.stdout.flush()
+
+def memoize_by_stat(maxsize=128):
+    """Cache a function of a file path until the file's mtime or size changes
+
+    The wrapped function gains cache_clear(), like functools.lru_cache.
+    """
+    def decorator(func):
+        @lru_cache(maxsize=maxsize)
+        def cached(path, mtime_ns, size, *args, **kwargs):
+            return func(path, *args, **kwargs)
+
+        @wraps(func)
+        def wrapper(path, *args, **kwargs):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            return cached(path, stat.st_mtime_ns, stat.st_size, *args, **kwargs)
+
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
+# Validation counts the same upload repeatedly; counts are reused until the file changes
+@memoize_by_stat()
+def fast_line_count(path, chunk_size=1 << 20):
+    """Count lines by scanning raw 1 MiB chunks for newlines"""
+    count, last = 0, b'\n'
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        while True:
+            chunk = os.read(fd, chunk_size)
+            if not chunk:
+                break
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    finally:
+        os.close(fd)
+    # A final line without a trailing newline still counts
+    return count + (last != b'\n')
+
+def text_file_problem(path, head_size=1 << 16, min_size=1 << 20):
+    """Why path can't be a newline-delimited text dataset, judged from its first 64 KiB
+
+    Returns None when the head looks like UTF-8 text, so obviously wrong uploads
+    are rejected without scanning the whole file.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(head_size)
+    try:
+        # Incremental decode tolerates a multi-byte character cut off at the end of the head
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return "not UTF-8 text"
+    if b'\n' not in head and os.path.getsize(path) > min_size:
+        return "not newline-delimited text"
+    return None
+
+def _count_marked_lines(path, marks, block_size):
+    """Count lines holding at least one byte selected by marks(block), scanning with NumPy"""
+    import mmap
+    import numpy as np
+
+    if os.path.getsize(path) == 0:
+        return 0
+
+    count, lines_before, last_line = 0, 0, -1
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        for start in range(0, buf.size, block_size):
+            block = buf[start:start + block_size]
+            newlines = np.flatnonzero(block == 0x0A)
+            marked = np.flatnonzero(marks(block))
+            if marked.size:
+                # Line index of every marked byte; each distinct index is one counted line
+                line_ids = lines_before + np.searchsorted(newlines, marked)
+                count += int(np.count_nonzero(np.diff(line_ids))) + int(line_ids[0] != last_line)
+                last_line = line_ids[-1]
+            lines_before += newlines.size
+        # Release the views before the mmap closes, or close() raises BufferError
+        del buf, block
+    return count
+
+@memoize_by_stat()
+def count_nonblank_lines(path, block_size=1 << 24):
+    """Count lines containing any non-whitespace byte"""
+    # Anything other than ASCII whitespace (\t..\r and space)
+    return _count_marked_lines(path, lambda block: (block > 0x20) | (block < 0x09), block_size)
+
+@memoize_by_stat()
+def count_lines_containing(path, char, block_size=1 << 24):
+    """Count lines containing the single-byte character char"""
+    value = ord(char)
+    return _count_marked_lines(path, lambda block: block == value, block_size)
+
+def _read_messages():
+    """Yield raw request payloads from stdin in the active framing"""
+    if not LENGTH_FRAMED:
+        for line in sys.stdin.buffer:
+            line = line.strip()
+            if line:
+                yield line
+        return
+
+    stdin = sys.stdin.buffer
+    while True:
+        header = stdin.read(4)
+        if len(header) < 4:
+            return
+        yield stdin.read(int.from_bytes(header, 'big'))
+
+# Fixed replies are encoded once
+INVALID_JSON = dumps({"error": "Invalid JSON input"})
+
+def serve(operations):
+    """Answer JSON requests from stdin, one JSON response message each
+
+    operations maps a request's 'action' to a handler taking the request dict.
+    """
+    for raw in _read_messages():
+        try:
+            data = loads(raw)
+        except ValueError:
+            write_message(INVALID_JSON)
+            sys.stdout.flush()
+            continue
+
+        action = data.get('action') if isinstance(data, dict) else None
+        handler = operations.get(action)
+        if handler is None:
+            print_json({"error": f"Unknown action: {action}"})
+            continue
+
+        try:
+            result = handler(data)
+        except Exception as e:
+            result = {"error": str(e)}
+        print_json(result)
@@ -6,49 +6,101 @@ Handles memory optimization, batch processing, and resource management
 
 import os
 import sys
-import json
 import psutil
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from typing import Dict, Any, List, Mapping, Optional, Tuple
+from types import MappingProxyType
 from pathlib import Path
 import multiprocessing as mp
 from functools import lru_cache
 import gc
 import time
+import ctypes
+
+from ml_ops import loads, print_json
 
 logger = logging.getLogger(__name__)
 
+# psutil.virtual_memory() reads and parses /proc/meminfo; reuse a reading this long
+MEMORY_READING_TTL = 0.5
+_memory_reading = (0.0, None)
+
+def _virtual_memory(max_age: float = MEMORY_READING_TTL):
+    """Return psutil.virtual_memory(), re-read only when older than max_age seconds"""
+    global _memory_reading
+    taken_at, memory = _memory_reading
+    now = time.monotonic()
+    if memory is None or now - taken_at >= max_age:
+        memory = psutil.virtual_memory()
+        _memory_reading = (now, memory)
+    return memory
+
+# Estimated memory per sample in GB (varies by model)
+MEMORY_PER_SAMPLE_GB: Mapping[str, float] = MappingProxyType({
+    'gpt2': 0.05,
+    'distilbert': 0.03,
+    'tinybert': 0.02
+})
+
+# Time per sample in seconds (empirical estimates)
+TIME_PER_SAMPLE_SECONDS: Mapping[str, float] = MappingProxyType({
+    'gpt2': 0.1,
+    'distilbert': 0.08,
+    'tinybert': 0.05
+})
+
+@lru_cache(maxsize=None)
+def _optimal_batch_size(available_memory_mb: int) -> int:
+    """Batch size for the given available memory, memoized per MiB of memory"""
+    # Get available memory in GB
+    available_gb = available_memory_mb / 1024
+    
+    # Conservative approach: use 60% of available memory
+    usable_memory = available_gb * 0.6
+    
+    # Default to GPT-2 estimation
+    est_memory = MEMORY_PER_SAMPLE_GB['gpt2']
+    
+    # Calculate batch size
+    batch_size = max(1, int(usable_memory / est_memory))
+    
+    # Cap at reasonable limits
+    return min(batch_size, 32)
+
+@lru_cache(maxsize=1024)
+def _estimate_training_time(dataset_size: int, model_type: str, batch_size: int, epochs: int) -> Dict[str, Any]:
+    """Training time estimate, memoized on the inputs that determine it"""
+    base_time = TIME_PER_SAMPLE_SECONDS.get(model_type, 0.1)
+    
+    # Adjust for batch processing efficiency
+    batch_efficiency = 1.0 - (0.3 * (batch_size / 32))
+    
+    total_samples = dataset_size * epochs
+    estimated_seconds = (total_samples * base_time * batch_efficiency)
+    
+    # Add overhead for evaluation and checkpointing
+    overhead = estimated_seconds * 0.2
+    total_seconds = estimated_seconds + overhead
+    
+    return {
+        'estimated_minutes': round(total_seconds / 60, 1),
+        'estimated_seconds': round(total_seconds),
+        'samples_per_second': round(dataset_size / estimated_seconds, 2)
+    }
+
+
 class MLOptimizer:
     """Advanced ML optimization for constrained environments"""
     
     def __init__(self):
         self.cpu_count = mp.cpu_count()
-        self.available_memory = psutil.virtual_memory().available
+        self.available_memory = _virtual_memory().available
         self.optimal_batch_size = self._calculate_optimal_batch_size()
         
     def _calculate_optimal_batch_size(self) -> int:
         """Calculate optimal batch size based on available resources"""
-        # Get available memory in GB
-        available_gb = self.available_memory / (1024 ** 3)
-        
-        # Conservative approach: use 60% of available memory
-        usable_memory = available_gb * 0.6
-        
-        # Estimate memory per sample (varies by model)
-        memory_per_sample = {
-            'gpt2': 0.05,  # GB per sample
-            'distilbert': 0.03,
-            'tinybert': 0.02
-        }
-        
-        # Default to GPT-2 estimation
-        est_memory = memory_per_sample.get('gpt2', 0.05)
-        
-        # Calculate batch size
-        batch_size = max(1, int(usable_memory / est_memory))
-        
-        # Cap at reasonable limits
-        return min(batch_size, 32)
+        return _optimal_batch_size(self.available_memory >> 20)
     
     def optimize_training_config(self, config: Dict[str, Any], dataset_size: int) -> Dict[str, Any]:
         """Optimize training configuration for performance"""
@@ -93,38 +145,18 @@ class MLOptimizer:
     
     def estimate_training_time(self, dataset_size: int, config: Dict[str, Any]) -> Dict[str, Any]:
         """Estimate training time based on dataset and configuration"""
-        batch_size = config.get('batch_size', 8)
-        epochs = config.get('max_epochs', 3)
-        model_type = config.get('model_type', 'gpt2')
-        
-        # Time per sample in seconds (empirical estimates)
-        time_per_sample = {
-            'gpt2': 0.1,
-            'distilbert': 0.08,
-            'tinybert': 0.05
-        }
-        
-        base_time = time_per_sample.get(model_type, 0.1)
-        
-        # Adjust for batch processing efficiency
-        batch_efficiency = 1.0 - (0.3 * (batch_size / 32))
-        
-        total_samples = dataset_size * epochs
-        estimated_seconds = (total_samples * base_time * batch_efficiency)
-        
-        # Add overhead for evaluation and checkpointing
-        overhead = estimated_seconds * 0.2
-        total_seconds = estimated_seconds + overhead
-        
-        return {
-            'estimated_minutes': round(total_seconds / 60, 1),
-            'estimated_seconds': round(total_seconds),
-            'samples_per_second': round(dataset_size / estimated_seconds, 2)
-        }
+        estimate = _estimate_training_time(
+            dataset_size,
+            config.get('model_type', 'gpt2'),
+            config.get('batch_size', 8),
+            config.get('max_epochs', 3)
+        )
+        # The cached dict is shared, so hand out a copy
+        return dict(estimate)
     
-    def get_memory_usage(self) -> Dict[str, float]:
-        """Get current memory usage statistics"""
-        memory = psutil.virtual_memory()
+    def get_memory_usage(self, max_age: float = MEMORY_READING_TTL) -> Dict[str, float]:
+        """Get current memory usage statistics, at most max_age seconds old"""
+        memory = _virtual_memory(max_age)
         return {
             'total_gb': memory.total / (1024 ** 3),
             'available_gb': memory.available / (1024 ** 3),
@@ -134,14 +166,24 @@ class MLOptimizer:
     
     def cleanup_memory(self):
         """Force garbage collection and memory cleanup"""
+        # A full collection already covers every generation; repeating it frees nothing more
         gc.collect()
         
-        # Clear Python caches
-        for _ in range(3):
-            gc.collect()
+        # glibc keeps freed heap in its arenas; hand it back to the OS
+        if sys.platform == 'linux':
+            try:
+                ctypes.CDLL("libc.so.6").malloc_trim(0)
+            except (OSError, AttributeError):
+                pass
+        
+        # Release cached CUDA blocks, but don't import torch just to do so
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.ipc_collect()
             
         # Log memory status
-        memory_status = self.get_memory_usage()
+        memory_status = self.get_memory_usage(max_age=0)
         logger.info(f"Memory cleanup complete. Available: {memory_status['available_gb']:.2f}GB")
     
     def validate_dataset_quality(self, dataset_path: str) -> Dict[str, Any]:
@@ -154,58 +196,77 @@ class MLOptimizer:
         }
         
         try:
-            # Read dataset
-            import pandas as pd
+            # Read dataset straight into Arrow; importing pandas alone costs more than most parses
+            import pyarrow as pa
+            import pyarrow.compute as pc
             
             file_ext = Path(dataset_path).suffix.lower()
             
             if file_ext == '.csv':
-                df = pd.read_csv(dataset_path)
+                import pyarrow.csv as pa_csv
+                table = pa_csv.read_csv(dataset_path)
             elif file_ext == '.json':
-                df = pd.read_json(dataset_path)
+                import pyarrow.json as pa_json
+                try:
+                    # Newline-delimited records
+                    table = pa_json.read_json(dataset_path)
+                except pa.ArrowInvalid:
+                    # A single top-level array of records
+                    with open(dataset_path, 'rb') as f:
+                        table = pa.Table.from_pylist(loads(f.read()))
             else:
-                # Text file
-                with open(dataset_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                df = pd.DataFrame({'text': lines})
+                # Text file: one bulk read, split into non-empty lines inside Arrow
+                with open(dataset_path, 'rb') as f:
+                    raw = f.read().translate(None, b'\r')
+                lines = pc.split_pattern(pa.array([raw.decode('utf-8', 'replace')]), '\n').flatten()
+                table = pa.table({'text': lines.filter(pc.not_equal(lines, ''))})
+            
+            columns = table.column_names
+            total_samples = table.num_rows
             
             # Basic statistics
             results['statistics'] = {
-                'total_samples': len(df),
-                'columns': list(df.columns) if hasattr(df, 'columns') else ['text'],
-                'memory_usage_mb': df.memory_usage(deep=True).sum() / (1024 * 1024)
+                'total_samples': total_samples,
+                'columns': columns,
+                'memory_usage_mb': table.nbytes / (1024 * 1024)
             }
             
             # Quality checks
-            if len(df) < 10:
+            if total_samples < 10:
                 results['warnings'].append("Very small dataset (< 10 samples)")
                 results['recommendations'].append("Consider adding more training examples for better results")
             
-            if len(df) < 100:
+            if total_samples < 100:
                 results['warnings'].append("Small dataset (< 100 samples)")
                 results['recommendations'].append("Model may overfit. Consider data augmentation")
             
-            # Check for duplicates
-            if hasattr(df, 'duplicated'):
-                duplicates = df.duplicated().sum()
-                if duplicates > 0:
-                    results['warnings'].append(f"Found {duplicates} duplicate samples")
-                    results['recommendations'].append("Remove duplicates for better training efficiency")
+            # Check for duplicates: grouping on every column leaves one row per distinct sample
+            try:
+                duplicates = total_samples - table.group_by(columns).aggregate([]).num_rows
+            except pa.ArrowNotImplementedError:
+                # Nested column types can't be grouped on
+                duplicates = 0
+            if duplicates > 0:
+                results['warnings'].append(f"Found {duplicates} duplicate samples")
+                results['recommendations'].append("Remove duplicates for better training efficiency")
             
             # Check text lengths
-            if 'text' in df.columns or len(df.columns) == 1:
-                text_col = df.columns[0] if len(df.columns) == 1 else 'text'
-                text_lengths = df[text_col].astype(str).str.len()
+            if 'text' in columns or len(columns) == 1:
+                text_col = columns[0] if len(columns) == 1 else 'text'
+                text_lengths = pc.utf8_length(pc.cast(table[text_col], pa.string()))
+                length_range = pc.min_max(text_lengths)
+                min_length = length_range['min'].as_py()
+                max_length = length_range['max'].as_py()
                 
-                results['statistics']['avg_text_length'] = text_lengths.mean()
-                results['statistics']['max_text_length'] = text_lengths.max()
-                results['statistics']['min_text_length'] = text_lengths.min()
+                results['statistics']['avg_text_length'] = pc.mean(text_lengths).as_py()
+                results['statistics']['max_text_length'] = max_length
+                results['statistics']['min_text_length'] = min_length
                 
-                if text_lengths.max() > 2000:
+                if max_length is not None and max_length > 2000:
                     results['warnings'].append("Some texts are very long (> 2000 chars)")
                     results['recommendations'].append("Consider chunking long texts for better processing")
                 
-                if text_lengths.min() < 10:
+                if min_length is not None and min_length < 10:
                     results['warnings'].append("Some texts are very short (< 10 chars)")
                     results['recommendations'].append("Very short texts may not provide enough context")
             
@@ -219,19 +280,71 @@ class MLOptimizer:
 class TrainingMonitor:
     """Advanced training monitoring with real-time metrics"""
     
-    def __init__(self):
-        self.metrics_history = []
+    def __init__(self, capacity: int = 4096):
+        # Metrics are kept column-wise in fixed-size ring buffers holding the
+        # most recent `capacity` steps
+        self.capacity = capacity
+        self._epoch = np.empty(capacity, dtype=np.int32)
+        self._step = np.empty(capacity, dtype=np.int64)
+        self._loss = np.empty(capacity, dtype=np.float64)
+        self._learning_rate = np.empty(capacity, dtype=np.float64)
+        self._elapsed = np.empty(capacity, dtype=np.float64)
+        self._timestamp = np.empty(capacity, dtype=np.float64)
+        self._count = 0
+        self._first_loss = None
         self.start_time = None
         self.best_loss = float('inf')
         
     def start_monitoring(self):
         """Start training monitoring"""
         self.start_time = time.time()
-        self.metrics_history = []
+        self._count = 0
+        self._first_loss = None
+        
+    def _recent(self, column: np.ndarray, n: int) -> np.ndarray:
+        """Return the last n values of a metric column in logging order"""
+        n = min(n, self._count, self.capacity)
+        end = self._count % self.capacity
+        if n <= end:
+            return column[end - n:end]
+        return np.concatenate((column[end - n:], column[:end]))
+    
+    @property
+    def metrics_history(self) -> List[Dict[str, Any]]:
+        """Retained metrics as a list of per-step dicts (oldest first)"""
+        n = min(self._count, self.capacity)
+        columns = zip(
+            self._recent(self._epoch, n), self._recent(self._step, n),
+            self._recent(self._loss, n), self._recent(self._learning_rate, n),
+            self._recent(self._elapsed, n), self._recent(self._timestamp, n)
+        )
+        return [
+            {
+                'epoch': int(epoch),
+                'step': int(step),
+                'loss': float(loss),
+                'learning_rate': float(lr),
+                'elapsed_seconds': float(elapsed),
+                'timestamp': float(timestamp)
+            }
+            for epoch, step, loss, lr, elapsed, timestamp in columns
+        ]
         
     def log_metrics(self, epoch: int, step: int, loss: float, learning_rate: float):
         """Log training metrics"""
-        elapsed_time = time.time() - self.start_time
+        now = time.time()
+        elapsed_time = now - self.start_time
+        
+        i = self._count % self.capacity
+        self._epoch[i] = epoch
+        self._step[i] = step
+        self._loss[i] = loss
+        self._learning_rate[i] = learning_rate
+        self._elapsed[i] = elapsed_time
+        self._timestamp[i] = now
+        self._count += 1
+        if self._first_loss is None:
+            self._first_loss = float(loss)
         
         metrics = {
             'epoch': epoch,
@@ -239,11 +352,9 @@ class TrainingMonitor:
             'loss': loss,
             'learning_rate': learning_rate,
             'elapsed_seconds': elapsed_time,
-            'timestamp': time.time()
+            'timestamp': now
         }
         
-        self.metrics_history.append(metrics)
-        
         # Track best loss
         if loss < self.best_loss:
             self.best_loss = loss
@@ -253,43 +364,41 @@ class TrainingMonitor:
     
     def get_training_summary(self) -> Dict[str, Any]:
         """Get comprehensive training summary"""
-        if not self.metrics_history:
+        if not self._count:
             return {}
         
         total_time = time.time() - self.start_time
-        losses = [m['loss'] for m in self.metrics_history]
+        final_loss = float(self._recent(self._loss, 1)[0])
         
         return {
             'total_training_time_seconds': total_time,
             'total_training_time_minutes': total_time / 60,
-            'total_steps': len(self.metrics_history),
+            'total_steps': self._count,
             'best_loss': self.best_loss,
-            'final_loss': losses[-1] if losses else None,
-            'loss_improvement': (losses[0] - losses[-1]) / losses[0] * 100 if losses else 0,
-            'avg_step_time': total_time / len(self.metrics_history) if self.metrics_history else 0
+            'final_loss': final_loss,
+            'loss_improvement': (self._first_loss - final_loss) / self._first_loss * 100,
+            'avg_step_time': total_time / self._count
         }
     
     def detect_training_issues(self) -> List[str]:
         """Detect potential training issues"""
         issues = []
         
-        if len(self.metrics_history) < 5:
+        if self._count < 5:
             return issues
         
-        recent_losses = [m['loss'] for m in self.metrics_history[-5:]]
+        recent_losses = self._recent(self._loss, 5)
         
         # Check for loss explosion
-        if any(loss > self.metrics_history[0]['loss'] * 2 for loss in recent_losses):
+        if np.any(recent_losses > self._first_loss * 2):
             issues.append("Loss explosion detected - consider reducing learning rate")
         
         # Check for plateauing
-        loss_variance = max(recent_losses) - min(recent_losses)
-        if loss_variance < 0.001:
+        if np.ptp(recent_losses) < 0.001:
             issues.append("Loss plateauing - consider adjusting learning rate or early stopping")
         
-        # Check for oscillation
-        loss_changes = [recent_losses[i] - recent_losses[i-1] for i in range(1, len(recent_losses))]
-        if sum(1 for change in loss_changes if change > 0) >= 3:
+        # Check for oscillation: count rising steps with one vectorized compare
+        if np.count_nonzero(np.diff(recent_losses) > 0) >= 3:
             issues.append("Loss oscillation detected - learning rate might be too high")
         
         return issues
@@ -341,24 +450,24 @@ if __name__ == "__main__":
         command = sys.argv[1]
         
         if command == "optimize":
-            config = json.loads(sys.argv[2])
+            config = loads(sys.argv[2])
             dataset_size = int(sys.argv[3])
             
             optimizer = MLOptimizer()
             optimized_config = optimizer.optimize_training_config(config, dataset_size)
-            print(json.dumps(optimized_config))
+            print_json(optimized_config)
             
         elif command == "validate":
             dataset_path = sys.argv[2]
             
             optimizer = MLOptimizer()
             validation_results = optimizer.validate_dataset_quality(dataset_path)
-            print(json.dumps(validation_results))
+            print_json(validation_results)
             
         elif command == "estimate":
             dataset_size = int(sys.argv[2])
-            config = json.loads(sys.argv[3])
+            config = loads(sys.argv[3])
             
             optimizer = MLOptimizer()
             time_estimate = optimizer.estimate_training_time(dataset_size, config)
-            print(json.dumps(time_estimate))
\ No newline at end of file
+            print_json(time_estimate)
\ No newline at end of file
@@ -6,6 +6,8 @@ import os
 import time
 import random
 
+from ml_ops import print_json, write_message, fast_line_count, count_lines_containing, serve
+
 def validate_dataset(data):
     """Validate dataset format and quality"""
     try:
@@ -17,18 +19,13 @@ def validate_dataset(data):
         # Basic validation
         if dataset_path.endswith('.csv'):
             try:
-                with open(dataset_path, 'r') as f:
-                    lines = f.readlines()
-                sample_count = len(lines) - 1  # subtract header
+                sample_count = max(fast_line_count(dataset_path) - 1, 0)  # subtract header
             except:
                 return {"error": "Failed to read CSV file"}
         elif dataset_path.endswith('.txt'):
             try:
-                with open(dataset_path, 'r') as f:
-                    content = f.read()
                 # Count lines with | separator (question|answer format)
-                lines = [l.strip() for l in content.split('\n') if '|' in l.strip()]
-                sample_count = len(lines)
+                sample_count = count_lines_containing(dataset_path, '|')
             except:
                 return {"error": "Failed to read text file"}
         else:
@@ -61,24 +58,26 @@ def train_model(data):
             "message": "Training initialized",
             "status": "training"
         }
-        print(json.dumps(status_update))
-        sys.stdout.flush()
+        print_json(status_update)
+        
+        # Simulated training pace; set tick_ms to 0 to run without sleeping
+        tick = config.get('tick_ms', 300) / 1000
+        losses = [round(2.5 - (i * 0.2) + random.uniform(-0.1, 0.1), 4) for i in range(1, 11)]
+        # Progress lines differ only in their numbers, so format them from a fixed template
+        # ('%' in the job id is escaped so it isn't read as a format directive)
+        progress_line = (
+            b'{"type":"training_progress","job_id":' + json.dumps(job_id).encode().replace(b'%', b'%%') +
+            b',"progress":%d,"epoch":%d,"loss":%a,"status":"training"}'
+        )
+        started = time.time()
         
         # Training progress updates
-        for i in range(1, 11):
-            time.sleep(0.3)  # Simulate training time
-            loss = 2.5 - (i * 0.2) + random.uniform(-0.1, 0.1)
+        for i, loss in enumerate(losses, 1):
+            if tick:
+                time.sleep(tick)  # Simulate training time
             
             # Send progress update as separate JSON line
-            progress_data = {
-                "type": "training_progress",
-                "job_id": job_id,
-                "progress": i * 10,
-                "epoch": i,
-                "loss": round(loss, 4),
-                "status": "training"
-            }
-            print(json.dumps(progress_data))
+            write_message(progress_line % (i * 10, i, loss))
             sys.stdout.flush()
         
         # Simulate model saving
@@ -99,14 +98,13 @@ def train_model(data):
             "success": True,
             "job_id": job_id,
             "model_path": model_path,
-            "final_loss": round(loss, 4),
+            "final_loss": losses[-1],
             "epochs_completed": 10,
-            "training_time": 3.0,
+            "training_time": round(time.time() - started, 2),
             "status": "completed"
         }
         
-        print(json.dumps(final_result))
-        sys.stdout.flush()
+        print_json(final_result)
         
         return final_result
         
@@ -117,8 +115,7 @@ def train_model(data):
             "error": str(e),
             "status": "failed"
         }
-        print(json.dumps(error_result))
-        sys.stdout.flush()
+        print_json(error_result)
         return error_result
 
 def test_model(data):
@@ -161,39 +158,25 @@ def get_system_info():
     except Exception as e:
         return {"error": str(e)}
 
+# Request actions and their handlers
+OPERATIONS = {
+    'validate': validate_dataset,
+    'validate_dataset': validate_dataset,
+    'train': train_model,
+    'train_model': train_model,
+    'test': test_model,
+    'test_model': test_model,
+    'get_system_info': lambda data: get_system_info(),
+}
+
 def main():
     """Main service loop"""
     try:
-        for line in sys.stdin:
-            try:
-                data = json.loads(line.strip())
-                action = data.get('action')
-                
-                if action == 'validate_dataset' or action == 'validate':
-                    result = validate_dataset(data)
-                elif action == 'train_model' or action == 'train':
-                    result = train_model(data)
-                elif action == 'test_model' or action == 'test':
-                    result = test_model(data)
-                elif action == 'get_system_info':
-                    result = get_system_info()
-                else:
-                    result = {"error": f"Unknown action: {action}"}
-                
-                print(json.dumps(result))
-                sys.stdout.flush()
-                
-            except json.JSONDecodeError:
-                print(json.dumps({"error": "Invalid JSON input"}))
-                sys.stdout.flush()
-            except Exception as e:
-                print(json.dumps({"error": str(e)}))
-                sys.stdout.flush()
-                
+        serve(OPERATIONS)
     except KeyboardInterrupt:
-        print(json.dumps({"status": "Service stopped"}))
+        print_json({"status": "Service stopped"})
     except Exception as e:
-        print(json.dumps({"error": f"Service error: {str(e)}"}))
+        print_json({"error": f"Service error: {str(e)}"})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -689,11 +689,11 @@ EOF
 
 # Test Python ML service
 echo "🧪 Testing Python ML service..."
-if python3 server/ml_service.py validate '{"dataset_path": "sample_data.txt"}' > /dev/null 2>&1; then
+if echo '{"action": "validate", "dataset_path": "sample_data.txt"}' | python3 server/ml_service.py > /dev/null 2>&1; then
     echo "✅ Python ML service working"
 else
     echo "❌ Python ML service test failed"
-    echo "Try running: python3 server/ml_service.py validate '{\"dataset_path\": \"sample_data.txt\"}'"
+    echo "Try running: echo '{\"action\": \"validate\", \"dataset_path\": \"sample_data.txt\"}' | python3 server/ml_service.py"
     exit 1
 fi
 
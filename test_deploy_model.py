@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Test the standalone model server in deploy_model.py
+Usage: python test_deploy_model.py [model_path]
+"""
+
+import sys
+
+def test_shared_prefix(model_path):
+    """Two requests sharing a prompt prefix; the second reuses the first one's KV cache"""
+    try:
+        from fastapi.testclient import TestClient
+        import deploy_model
+    except ImportError as e:
+        print(f"✗ Import error: {e}")
+        return False
+
+    if not deploy_model.load_model(model_path):
+        print(f"✗ Could not load model from {model_path}")
+        return False
+
+    prefix = "The quick brown fox jumps over the lazy dog. "
+    # The client context runs the app's lifespan, which starts the batch worker
+    with TestClient(deploy_model.app) as client:
+        for suffix in ("Then it", "After that it"):
+            response = client.post('/generate', json={
+                'prompt': prefix + suffix, 'max_length': 8, 'temperature': 0.7
+            })
+            if response.status_code != 200:
+                print(f"✗ Request failed with {response.status_code}: {response.json()}")
+                return False
+            print(f"✓ Generated: {response.json()['generated_text']!r}")
+
+    if not deploy_model.prefix_cache:
+        print("✗ No prompt prefix was cached")
+        return False
+    print(f"✓ Prefix cache holds {len(deploy_model.prefix_cache)} prompt(s)")
+
+    # A new prompt with the same prefix must find it in the cache
+    token_ids = deploy_model.tokenizer(prefix + "Finally it")['input_ids']
+    if deploy_model.lookup_prefix(token_ids) is None:
+        print("✗ Shared prefix was not found in the cache")
+        return False
+    print("✓ Shared prefix found in the cache")
+    return True
+
+def main():
+    print("Testing model deployment server...")
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "gpt2"
+
+    if not test_shared_prefix(model_path):
+        return 1
+
+    print("✓ All deployment tests passed!")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,8 +5,81 @@ Test OCR functionality for the ML Training Platform
 
 import os
 import sys
+import glob
 import json
 import subprocess
+import threading
+
+# orjson is optional; fall back to the stdlib encoder when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj):
+    """Encode a JSON document to str, via orjson when available"""
+    return orjson.dumps(obj).decode() if orjson else json.dumps(obj)
+
+def loads(raw):
+    """Parse a JSON document, via orjson when available"""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+class OCRWorker:
+    """One long-lived ML service process, answering newline-delimited JSON requests
+
+    The service's imports are paid for once, however many requests are sent.
+    The process is killed if the whole session outlives budget seconds.
+    """
+
+    def __init__(self, script="server/ml_service_unified.py", budget=60):
+        self.script = script
+        self.budget = budget
+        self.proc = None
+        self._timer = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-u", self.script],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True
+        )
+        self._timer = threading.Timer(self.budget, self.proc.kill)
+        self._timer.daemon = True
+        self._timer.start()
+
+        # The service announces itself before reading requests
+        ready = self.proc.stdout.readline()
+        if not ready:
+            raise RuntimeError("ML service exited before it was ready")
+        return self
+
+    def stream(self, payload):
+        """Send one request and yield each message as it arrives, ending with the response
+
+        Messages are parsed one line at a time, so earlier pages can be checked
+        before later ones are recognized.
+        """
+        self.proc.stdin.write(dumps(payload) + "\n")
+        self.proc.stdin.flush()
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise RuntimeError("ML service closed its output")
+            message = loads(line)
+            yield message
+            if message.get("type") != "ocr_page":
+                return
+
+    def __exit__(self, *exc_info):
+        self._timer.cancel()
+        self.proc.stdin.close()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        return False
 
 def test_ocr_functionality():
     """Test OCR functionality with sample PDF"""
@@ -25,26 +98,30 @@ def test_ocr_functionality():
             print(f"❌ Import error: {e}")
             return False
         
-        # Test ML service
+        # Test ML service; every sample PDF goes in one request, so the service
+        # OCRs all of their pages on a single worker pool
+        pdf_paths = sorted(glob.glob("*.pdf")) or ["sample_test.pdf"]
         test_data = {
-            "operation": "extract_pdf_text",
-            "pdf_path": "sample_test.pdf"
+            "action": "extract_pdf_text_batched",
+            "pdf_paths": pdf_paths,
+            # Rendered pages are kept per PDF content hash, so reruns skip Poppler
+            "render_cache": os.path.join(".cache", "ocr_pages"),
+            "stream_pages": True
         }
         
         try:
-            result = subprocess.run([
-                sys.executable, 
-                "server/ml_service_unified.py"
-            ], 
-            input=json.dumps(test_data), 
-            text=True, 
-            capture_output=True, 
-            timeout=10
-            )
+            pages = 0
+            with OCRWorker() as worker:
+                for response in worker.stream(test_data):
+                    if response.get("type") == "ocr_page":
+                        pages += 1
+                        print(f"  page {response['page']} of {response['pdf_path']}: "
+                              f"{len(response['text'])} chars, confidence {response['confidence']:.0f}")
             
-            if result.returncode == 0:
-                response = json.loads(result.stdout)
-                print("✅ ML service OCR test successful:", response.get('status', 'unknown'))
+            failed = [r for r in response.get('results', []) if "error" in r]
+            if "error" not in response and not failed:
+                print(f"✅ ML service OCR test successful: {len(pdf_paths)} PDF(s) extracted, "
+                      f"{pages} OCR page(s) streamed")
             else:
                 print("⚠️ ML service test failed, but service is available")
                 
@@ -3,28 +3,105 @@
 import websockets
 import asyncio
 import json
+import os
+
+# orjson is optional; fall back to the stdlib encoder when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj):
+    """Encode a JSON document to str, via orjson when available"""
+    return orjson.dumps(obj).decode() if orjson else json.dumps(obj)
+
+def loads(raw):
+    """Parse a JSON document, via orjson when available"""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+# Outgoing frames are queued and sent together once FLUSH_COUNT are waiting
+# or FLUSH_INTERVAL seconds have passed, whichever comes first
+FLUSH_COUNT = 8
+FLUSH_INTERVAL = 0.05
+
+# Heartbeats are a few dozen bytes on a local link, where deflate costs CPU and
+# saves nothing; set WS_COMPRESSION=deflate to offer it on slower links
+COMPRESSION = os.environ.get("WS_COMPRESSION") or None
+
+# Frames already buffered are handled together; the loop stops collecting
+# once none has arrived for DRAIN_TIMEOUT seconds
+DRAIN_TIMEOUT = 0.002
+
+async def flush_pending(websocket, pending):
+    """Send every queued frame in one gather and empty the queue"""
+    if pending:
+        frames = pending[:]
+        pending.clear()
+        await asyncio.gather(*(websocket.send(frame) for frame in frames))
+
+async def flush_periodically(websocket, pending):
+    """Bound how long a queued frame waits when traffic is light"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush_pending(websocket, pending)
+
+async def drain(websocket, timeout=DRAIN_TIMEOUT):
+    """Wait for one frame, then collect every further frame arriving within timeout seconds
+
+    Returns the frames and whether the connection closed while collecting them;
+    frames received before the close are still returned.
+    """
+    batch = [await websocket.recv()]
+    while True:
+        try:
+            batch.append(await asyncio.wait_for(websocket.recv(), timeout))
+        except asyncio.TimeoutError:
+            return batch, False
+        except websockets.ConnectionClosedOK:
+            return batch, True
 
 async def test_websocket():
     uri = "ws://localhost:5000/ws"
     try:
-        async with websockets.connect(uri) as websocket:
+        # Never stop reading because unprocessed frames piled up
+        async with websockets.connect(uri, max_queue=None, compression=COMPRESSION) as websocket:
             print("Connected to WebSocket")
+            pending = []
+            flusher = asyncio.create_task(flush_periodically(websocket, pending))
             
             # Send initial message
-            await websocket.send(json.dumps({"type": "test", "message": "Hello"}))
+            pending.append(dumps({"type": "test", "message": "Hello"}))
             
             # Listen for messages
-            async for message in websocket:
-                data = json.loads(message)
-                print(f"Received: {data}")
-                
-                if data.get("type") == "heartbeat":
-                    # Respond to heartbeat
-                    await websocket.send(json.dumps({"type": "heartbeat", "timestamp": data["timestamp"]}))
-                    print("Responded to heartbeat")
+            try:
+                closed = False
+                while not closed:
+                    try:
+                        batch, closed = await drain(websocket)
+                    except websockets.ConnectionClosedOK:
+                        break
+                    for message in batch:
+                        data = loads(message)
+                        print(f"Received: {data}")
+                        
+                        if data.get("type") == "heartbeat":
+                            # Respond to heartbeat
+                            pending.append(dumps({"type": "heartbeat", "timestamp": data["timestamp"]}))
+                            print("Responded to heartbeat")
+                    if len(pending) >= FLUSH_COUNT and not closed:
+                        await flush_pending(websocket, pending)
+            finally:
+                flusher.cancel()
                 
     except Exception as e:
         print(f"WebSocket error: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(test_websocket())
\ No newline at end of file
+    # uvloop is optional (Linux and macOS only); it speeds up the event loop when installed.
+    # uvloop.run replaces the deprecated install() + asyncio.run pairing
+    try:
+        import uvloop
+        run = uvloop.run
+    except (ImportError, AttributeError):
+        run = asyncio.run
+    run(test_websocket())